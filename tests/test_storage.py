@@ -1,20 +1,89 @@
+import atexit
 import base64
+import binascii
+import functools
 import gzip
+import hashlib
 import io
 import json
+import mmap
 import os
-import random
 import re
 import string
 import tempfile
+import threading
 import time
+import traceback
 import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from libcloud.storage import providers, types
+from libcloud.http import LibcloudConnection
+from libcloud.storage import types
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import docker
+except ImportError:
+    docker = None
+
+try:
+    from azure.common.credentials import ServicePrincipalCredentials
+    from azure.mgmt.resource import ResourceManagementClient
+except ImportError:
+    ServicePrincipalCredentials = ResourceManagementClient = None
+
+try:
+    from azure.storage.blob import ContainerClient
+except ImportError:
+    ContainerClient = None
 
 MB = 1024 * 1024
 
+MAX_CONNECTIONS = 16
+
+BLOB_BATCH_SIZE = 256
+
+CONFIG_ENV = "LIBCLOUD_TESTS_CONFIG"
+
+# transfer files up to this size are kept in memory unless TMPDIR is set
+IN_MEMORY_MAX_SIZE = 16 * MB
+
+_IN_MEMORY = not os.getenv("TMPDIR")
+_MEMFD = hasattr(os, "memfd_create")
+_SHM = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+_ALNUM = frozenset(string.ascii_lowercase + string.digits)
+
+_HTTP = requests.Session()
+for _scheme in "http://", "https://":
+    _HTTP.mount(
+        _scheme,
+        HTTPAdapter(
+            pool_connections=MAX_CONNECTIONS,
+            pool_maxsize=MAX_CONNECTIONS,
+            max_retries=Retry(total=3, backoff_factor=0.1, status_forcelist=[429, 503]),
+        ),
+    )
+atexit.register(_HTTP.close)
+
+# no retries here since the tests check how libcloud handles error responses
+_LIBCLOUD_HTTP = HTTPAdapter(
+    pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS
+)
+atexit.register(_LIBCLOUD_HTTP.close)
+
+
+class _PooledConnection(LibcloudConnection):
+    # libcloud creates a new session per connection so share the pools instead
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for scheme in "http://", "https://":
+            self.session.mount(scheme, _LIBCLOUD_HTTP)
+
 
 class SmokeStorageTest(unittest.TestCase):
     class Config:
@@ -22,31 +91,109 @@ class SmokeStorageTest(unittest.TestCase):
         account = None
         secret = None
 
-    def setUp(self):
+    driver = None
+    container = None
+    blob_batch = None
+
+    # each pytest-xdist worker runs setUpClass so only spread the tests over
+    # several workers if that's cheap, i.e. it just creates a container
+    parallel = True
+
+    # whether this class rather than the CLI started the backend
+    owns_backend = False
+
+    @classmethod
+    def setUpClass(cls):
+        # outside of the CLI, e.g. under plain pytest or unittest, nobody else
+        # starts the backend so the class does it for its own tests
+        cls.owns_backend = not os.getenv(CONFIG_ENV)
+        if cls.owns_backend:
+            cls.start_backend()
+
+        try:
+            cls._create_container()
+        except Exception:
+            if cls.owns_backend:
+                cls.stop_backend()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            cls._delete_container()
+        finally:
+            if cls.owns_backend:
+                cls.stop_backend()
+
+    @classmethod
+    def _create_container(cls):
         for required in "provider", "account", "secret":
-            value = getattr(self.Config, required, None)
+            value = getattr(cls.Config, required, None)
             if value is None:
                 raise unittest.SkipTest("config {} not set".format(required))
 
-        kwargs = {"key": self.Config.account, "secret": self.Config.secret}
+        cls.driver = cls._new_driver()
+        cls.container = cls.driver.create_container(_random_container_name())
 
-        for optional in "host", "port", "secure":
-            value = getattr(self.Config, optional, None)
-            if value is not None:
-                kwargs[optional] = value
+        # only Azure itself supports the blob batch API, the emulators don't
+        is_azure = cls.Config.provider == "azure_blobs" and not getattr(
+            cls.Config, "host", None
+        )
+        if is_azure and ContainerClient is not None:
+            cls.blob_batch = ContainerClient(
+                account_url="https://{}.blob.core.windows.net".format(
+                    cls.Config.account
+                ),
+                container_name=cls.container.name,
+                credential=cls.Config.secret,
+            )
+
+    @classmethod
+    def _delete_container(cls):
+        cls._delete_objects(cls.container.list_objects())
+        cls.driver.delete_container(cls.container)
 
-        self.driver = providers.get_driver(self.Config.provider)(**kwargs)
+        if cls.blob_batch is not None:
+            cls.blob_batch.close()
+
+        # drop the idle keep-alive connections of this class' backend
+        _LIBCLOUD_HTTP.close()
+
+    # backends are started once per session by the CLI, outside of the
+    # pytest-xdist workers, so that all the workers share the same one;
+    # standalone runs start them in setUpClass instead
+    @classmethod
+    def start_backend(cls):
+        pass
+
+    @classmethod
+    def stop_backend(cls):
+        pass
+
+    def setUp(self):
+        # tests share the class' container so each works under its own prefix
+        self.prefix = uuid.uuid4().hex + "/"
 
     def tearDown(self):
-        for container in self.driver.list_containers():
-            for obj in container.list_objects():
-                obj.delete()
-            container.delete()
+        self._delete_objects(
+            self.driver.list_container_objects(self.container, ex_prefix=self.prefix)
+        )
 
     def test_containers(self):
         # make a new container
         container_name = _random_container_name()
         container = self.driver.create_container(container_name)
+
+        # the container lives outside of the test's prefix so tearDown won't
+        # clean it up if an assertion fails before it's deleted below
+        def delete_container():
+            try:
+                self.driver.delete_container(container)
+            except types.ContainerDoesNotExistError:
+                pass
+
+        self.addCleanup(delete_container)
+
         self.assertEqual(container.name, container_name)
         container = self.driver.get_container(container_name)
         self.assertEqual(container.name, container_name)
@@ -57,7 +204,7 @@ class SmokeStorageTest(unittest.TestCase):
 
         # check that the new container can be listed
         containers = self.driver.list_containers()
-        self.assertEqual([c.name for c in containers], [container_name])
+        self.assertIn(container_name, [c.name for c in containers])
 
         # delete the container
         self.driver.delete_container(container)
@@ -66,62 +213,99 @@ class SmokeStorageTest(unittest.TestCase):
         with self.assertRaises(types.ContainerDoesNotExistError):
             self.driver.get_container(container_name)
 
-        # check that the container is deleted
-        containers = self.driver.list_containers()
-        self.assertEqual([c.name for c in containers], [])
-
-    def _test_objects(self, do_upload, do_download, size=1 * MB):
+    def _test_objects(self, variant, do_upload, do_download, size=1 * MB):
+        # variants may run concurrently so each uses its own driver and prefix
+        driver = self._new_driver()
+        prefix = self.prefix + variant + "/"
         content = os.urandom(size)
-        blob_name = "testblob"
-        container = self.driver.create_container(_random_container_name())
+        blob_name = prefix + "testblob"
+        other_blob_name = prefix + "otherblob"
+        other_content = b"some other content"
+        container = self.container
 
         # upload a file
-        obj = do_upload(container, blob_name, content)
+        obj = do_upload(driver, container, blob_name, content)
         self.assertEqual(obj.name, blob_name)
-        obj = self.driver.get_object(container.name, blob_name)
-
-        # check that the file can be listed
-        blobs = self.driver.list_container_objects(container)
-        self.assertEqual([blob.name for blob in blobs], [blob_name])
 
-        # upload another file and check it's excluded in prefix listing
-        do_upload(container, blob_name[::-1], content[::-1])
-        blobs = self.driver.list_container_objects(container, ex_prefix=blob_name[0:3])
+        # upload another file and check that only the first one is listed
+        # under its prefix
+        do_upload(driver, container, other_blob_name, other_content)
+        blobs = driver.list_container_objects(container, ex_prefix=prefix + "tes")
         self.assertEqual([blob.name for blob in blobs], [blob_name])
 
-        # check that the file can be read back
-        self.assertEqual(do_download(obj), content)
+        # check that the file can be read back, comparing digests so that a
+        # failure doesn't try to print the content of large objects
+        self.assertEqual(_sha256(do_download(driver, obj)), _sha256(content))
 
         # delete the file
-        self.driver.delete_object(obj)
+        driver.delete_object(obj)
 
         # check that a missing file can't be deleted or looked up
         with self.assertRaises(types.ObjectDoesNotExistError):
-            self.driver.delete_object(obj)
+            driver.delete_object(obj)
         with self.assertRaises(types.ObjectDoesNotExistError):
-            self.driver.get_object(container.name, blob_name)
+            driver.get_object(container.name, blob_name)
 
         # check that the file is deleted
-        blobs = self.driver.list_container_objects(container)
-        self.assertEqual([blob.name for blob in blobs], [blob_name[::-1]])
+        blobs = driver.list_container_objects(container, ex_prefix=prefix)
+        self.assertEqual([blob.name for blob in blobs], [other_blob_name])
+
+    def test_object_roundtrip(self):
+        variants = [
+            ("file", self._upload_file, self._download_file),
+            ("stream_io", self._upload_stream_io, self._download_stream),
+            ("stream_iterable", self._upload_stream_iterable, self._download_stream),
+        ]
 
-    def test_objects(self, size=1 * MB):
-        def do_upload(container, blob_name, content):
-            infile = self._create_tempfile(content=content)
-            return self.driver.upload_object(infile, container, blob_name)
+        # the variants are independent round trips so run them concurrently
+        with ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            futures = [
+                executor.submit(self._test_objects, *variant) for variant in variants
+            ]
 
-        def do_download(obj):
-            outfile = self._create_tempfile()
-            self.driver.download_object(obj, outfile, overwrite_existing=True)
-            with open(outfile, "rb") as fobj:
-                return fobj.read()
+        # pytest doesn't support subTest so report every failed variant here
+        failures = []
+        for (name, _, _), future in zip(variants, futures):
+            error = future.exception()
+            if error is not None:
+                trace = traceback.format_exception(
+                    type(error), error, error.__traceback__
+                )
+                failures.append("variant {} failed:\n{}".format(name, "".join(trace)))
 
-        self._test_objects(do_upload, do_download, size)
+        if failures:
+            self.fail("\n".join(failures))
+
+    def _upload_file(self, driver, container, blob_name, content):
+        infile = self._create_tempfile(content=content)
+        return driver.upload_object(infile, container, blob_name)
+
+    def _download_file(self, driver, obj):
+        outfile = self._create_tempfile(size=obj.size)
+        driver.download_object(obj, outfile, overwrite_existing=True)
+        with open(outfile, "rb") as fobj:
+            mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.addCleanup(mapped.close)
+        return mapped
+
+    @staticmethod
+    def _upload_stream_io(driver, container, blob_name, content):
+        content = io.BytesIO(content)
+        return driver.upload_object_via_stream(content, container, blob_name)
+
+    @staticmethod
+    def _upload_stream_iterable(driver, container, blob_name, content):
+        chunks = _iter_chunks(content)
+        return driver.upload_object_via_stream(chunks, container, blob_name)
+
+    @staticmethod
+    def _download_stream(driver, obj):
+        return _read_stream(driver.download_object_as_stream(obj))
 
     def test_objects_range_downloads(self):
-        blob_name = "testblob-range"
+        blob_name = self.prefix + "testblob-range"
         content = b"0123456789"
-        container = self.driver.create_container(_random_container_name())
+        container = self.container
 
         infile = self._create_tempfile(content=content)
         obj = self.driver.upload_object(infile, container, blob_name)
@@ -145,28 +329,43 @@ class SmokeStorageTest(unittest.TestCase):
             },
         ]
 
-        for value in values:
-            # 1. download_object_range
+        outfiles = [self._create_tempfile() for _ in values]
+
+        # the ranges are independent so issue the requests concurrently
+        def download(driver, case):
+            value, outfile = case
             start_bytes = value["start_bytes"]
             end_bytes = value["end_bytes"]
-            outfile = self._create_tempfile()
 
-            result = self.driver.download_object_range(
+            # 1. download_object_range
+            result = driver.download_object_range(
                 obj,
                 outfile,
                 start_bytes=start_bytes,
                 end_bytes=end_bytes,
                 overwrite_existing=True,
             )
+
+            # 2. download_object_range_as_stream
+            streamed_content = _read_stream(
+                driver.download_object_range_as_stream(
+                    obj, start_bytes=start_bytes, end_bytes=end_bytes
+                )
+            )
+
+            return result, streamed_content
+
+        results = self._map_concurrently(download, zip(values, outfiles))
+
+        for value, outfile, (result, streamed_content) in zip(
+            values, outfiles, results
+        ):
             self.assertTrue(result)
 
             with open(outfile, "rb") as fobj:
                 downloaded_content = fobj.read()
 
-            if end_bytes is not None:
-                expected_content = content[start_bytes:end_bytes]
-            else:
-                expected_content = content[start_bytes:]
+            expected_content = content[value["start_bytes"] : value["end_bytes"]]
 
             msg = 'Expected "%s", got "%s" for values: %s' % (
                 expected_content,
@@ -175,44 +374,17 @@ class SmokeStorageTest(unittest.TestCase):
             )
             self.assertEqual(downloaded_content, expected_content, msg)
             self.assertEqual(downloaded_content, value["expected_content"], msg)
-
-            # 2. download_object_range_as_stream
-            downloaded_content = _read_stream(
-                self.driver.download_object_range_as_stream(
-                    obj, start_bytes=start_bytes, end_bytes=end_bytes
-                )
-            )
-            self.assertEqual(downloaded_content, expected_content)
+            self.assertEqual(streamed_content, expected_content)
 
     @unittest.skipUnless(os.getenv("LARGE_FILE_SIZE_MB"), "config not set")
     def test_objects_large(self):
         size = int(float(os.environ["LARGE_FILE_SIZE_MB"]) * MB)
-        self.test_objects(size)
-
-    def test_objects_stream_io(self):
-        def do_upload(container, blob_name, content):
-            content = io.BytesIO(content)
-            return self.driver.upload_object_via_stream(content, container, blob_name)
-
-        def do_download(obj):
-            return _read_stream(self.driver.download_object_as_stream(obj))
-
-        self._test_objects(do_upload, do_download)
-
-    def test_objects_stream_iterable(self):
-        def do_upload(container, blob_name, content):
-            content = iter([content[i : i + 1] for i in range(len(content))])
-            return self.driver.upload_object_via_stream(content, container, blob_name)
-
-        def do_download(obj):
-            return _read_stream(self.driver.download_object_as_stream(obj))
-
-        self._test_objects(do_upload, do_download)
+        self._test_objects("file", self._upload_file, self._download_file, size)
 
     def test_upload_via_stream_with_content_encoding(self):
-        object_name = "content_encoding.gz"
+        object_name = self.prefix + "content_encoding.gz"
         content = gzip.compress(os.urandom(MB // 100))
-        container = self.driver.create_container(_random_container_name())
+        container = self.container
         self.driver.upload_object_via_stream(
             iter(content), container, object_name, headers={"Content-Encoding": "gzip"}
         )
@@ -223,22 +395,84 @@ class SmokeStorageTest(unittest.TestCase):
 
     def test_cdn_url(self):
         content = os.urandom(MB // 100)
-        container = self.driver.create_container(_random_container_name())
-        obj = self.driver.upload_object_via_stream(iter(content), container, "cdn")
+        obj = self.driver.upload_object_via_stream(
+            iter(content), self.container, self.prefix + "cdn"
+        )
 
-        response = requests.get(self.driver.get_object_cdn_url(obj))
+        response = _HTTP.get(self.driver.get_object_cdn_url(obj))
         response.raise_for_status()
 
         self.assertEqual(response.content, content)
 
-    def _create_tempfile(self, prefix="", content=b""):
-        fobj, path = tempfile.mkstemp(prefix=prefix, text=False)
-        os.write(fobj, content)
-        os.close(fobj)
-        self.addCleanup(os.remove, path)
+    @classmethod
+    def _new_driver(cls):
+        kwargs = {"key": cls.Config.account, "secret": cls.Config.secret}
+
+        for optional in "host", "port", "secure":
+            value = getattr(cls.Config, optional, None)
+            if value is not None:
+                kwargs[optional] = value
+
+        driver = _driver_cls(cls.Config.provider)(**kwargs)
+        driver.connection.conn_class = _PooledConnection
+        driver.connection.connect()
+        return driver
+
+    @classmethod
+    def _delete_objects(cls, objects):
+        if cls.blob_batch is None:
+            cls._map_concurrently(
+                lambda driver, obj: driver.delete_object(obj), objects
+            )
+            return
+
+        names = [obj.name for obj in objects]
+        for offset in range(0, len(names), BLOB_BATCH_SIZE):
+            cls.blob_batch.delete_blobs(*names[offset : offset + BLOB_BATCH_SIZE])
+
+    @classmethod
+    def _map_concurrently(cls, func, items):
+        # drivers keep per-request state so each worker thread needs its own
+        local = threading.local()
+
+        def call(item):
+            if not hasattr(local, "driver"):
+                local.driver = cls._new_driver()
+            return func(local.driver, item)
+
+        with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+            return list(executor.map(call, items))
+
+    def _create_tempfile(self, prefix="", content=b"", size=None):
+        # large objects go to disk so that they don't take up several times
+        # their size in memory, e.g. for the upload and download files
+        size = len(content) if size is None else size
+        in_memory = _IN_MEMORY and size <= IN_MEMORY_MAX_SIZE
+        memfd = in_memory and _MEMFD
+
+        # anonymous memory files need no cleanup on disk and their path stays
+        # open()-able for as long as the descriptor is held
+        if memfd:
+            fobj = os.memfd_create(prefix or "libcloud-tests")
+            path = "/proc/self/fd/{}".format(fobj)
+            self.addCleanup(os.close, fobj)
+        else:
+            tempdir = _SHM if in_memory else None
+            fobj, path = tempfile.mkstemp(prefix=prefix, dir=tempdir, text=False)
+            self.addCleanup(os.remove, path)
+
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fobj, view[:MB]) :]
+
+        if not memfd:
+            os.close(fobj)
         return path
 
 
+@unittest.skipIf(
+    ResourceManagementClient is None, "missing azure-mgmt-resource library"
+)
 class AzureStorageTest(SmokeStorageTest):
     class Config:
         username = None
@@ -252,14 +486,11 @@ class AzureStorageTest(SmokeStorageTest):
     client = None
     resource_group_name = None
 
+    # every worker would deploy its own resource group and storage account
+    parallel = False
+
     @classmethod
     def setUpClass(cls):
-        try:
-            from azure.common.credentials import ServicePrincipalCredentials
-            from azure.mgmt.resource import ResourceManagementClient
-        except ImportError:
-            raise unittest.SkipTest("missing azure-mgmt-resource library")
-
         cls.client = ResourceManagementClient(
             credentials=ServicePrincipalCredentials(
                 client_id=cls.Config.username,
@@ -276,8 +507,27 @@ class AzureStorageTest(SmokeStorageTest):
             parameters={"location": cls.Config.location},
         )
 
-        with io.open(cls.Config.template_file, encoding="utf-8") as fobj:
-            template = json.load(fobj)
+        # the container work in the base class happens after the deployment so
+        # don't leak the resource group if any of it fails
+        try:
+            cls._deploy()
+            super().setUpClass()
+        except Exception:
+            cls._delete_resource_groups()
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        # deleting the resource group also removes the storage account, so do
+        # it even if the container cleanup in the base class fails
+        try:
+            super().tearDownClass()
+        finally:
+            cls._delete_resource_groups()
+
+    @classmethod
+    def _deploy(cls):
+        template = _arm_template(cls.Config.template_file)
 
         deployment = cls.client.deployments.create_or_update(
             resource_group_name=cls.resource_group_name,
@@ -295,7 +545,10 @@ class AzureStorageTest(SmokeStorageTest):
         cls.Config.provider = "azure_blobs"
 
     @classmethod
-    def tearDownClass(cls):
+    def _delete_resource_groups(cls):
+        # deletions take minutes so a short poll interval costs little but
+        # keeps the wait after the group is gone short
+        delay = 1
         while True:
             groups = [
                 group
@@ -315,24 +568,26 @@ class AzureStorageTest(SmokeStorageTest):
                     except Exception:  # pylint: disable=broad-except
                         pass
 
-            time.sleep(3)
+            time.sleep(delay)
+            delay = min(delay + 1, 3)
 
 
+@unittest.skipIf(docker is None, "missing docker library")
 class AzuriteStorageTest(SmokeStorageTest):
     class Config:
         port = 10000
         version = "latest"
 
     client = None
-    container = None
+    docker_container = None
     image = "arafato/azurite"
     has_sas_support = False
 
     @classmethod
-    def setUpClass(cls):
-        cls.client = _new_docker_client()
+    def start_backend(cls):
+        cls.client = docker.from_env()
 
-        cls.container = cls.client.containers.run(
+        cls.docker_container = cls.client.containers.run(
             "{}:{}".format(cls.image, cls.Config.version),
             detach=True,
             auto_remove=True,
@@ -349,11 +604,11 @@ class AzuriteStorageTest(SmokeStorageTest):
         cls.Config.secure = False
         cls.Config.provider = "azure_blobs"
 
-        time.sleep(5)
+        _wait_until_ready("http://{}:{}/".format(cls.Config.host, cls.Config.port))
 
     @classmethod
-    def tearDownClass(cls):
-        _kill_and_log(cls.container)
+    def stop_backend(cls):
+        _kill_and_log(cls.docker_container)
 
     def test_cdn_url(self):
         if not self.has_sas_support:
@@ -370,22 +625,23 @@ class AzuriteV3StorageTest(AzuriteStorageTest):
         )
 
 
+@unittest.skipIf(docker is None, "missing docker library")
 class IotedgeStorageTest(SmokeStorageTest):
     class Config:
         port = 11002
         version = "latest"
 
     client = None
-    container = None
+    docker_container = None
 
     @classmethod
-    def setUpClass(cls):
-        cls.client = _new_docker_client()
+    def start_backend(cls):
+        cls.client = docker.from_env()
 
         account = _random_string(10)
         key = base64.b64encode(_random_string(20).encode("ascii")).decode("ascii")
 
-        cls.container = cls.client.containers.run(
+        cls.docker_container = cls.client.containers.run(
             "mcr.microsoft.com/azure-blob-storage:{}".format(cls.Config.version),
             detach=True,
             auto_remove=True,
@@ -402,48 +658,127 @@ class IotedgeStorageTest(SmokeStorageTest):
         cls.Config.secure = False
         cls.Config.provider = "azure_blobs"
 
-        time.sleep(5)
+        _wait_until_ready("http://{}:{}/".format(cls.Config.host, cls.Config.port))
 
     @classmethod
-    def tearDownClass(cls):
-        _kill_and_log(cls.container)
+    def stop_backend(cls):
+        _kill_and_log(cls.docker_container)
 
 
-def _new_docker_client():
-    try:
-        import docker
-    except ImportError:
-        raise unittest.SkipTest("missing docker library")
+@functools.lru_cache(maxsize=None)
+def _driver_cls(provider):
+    from libcloud.storage import providers
+
+    return providers.get_driver(provider)
 
-    return docker.from_env()
+
+@functools.lru_cache(maxsize=None)
+def _arm_template(path):
+    with io.open(path, encoding="utf-8") as fobj:
+        return json.load(fobj)
+
+
+def _wait_until_ready(url, timeout=30):
+    # docker accepts connections on published ports before the service in the
+    # container listens, so wait for an actual HTTP response of any status
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _HTTP.get(url, timeout=1)
+        except requests.RequestException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+        else:
+            return
 
 
 def _kill_and_log(container):
-    for line in container.logs().splitlines():
-        print(line)
+    if container is None:
+        return
+
+    # read the logs before killing since auto_remove discards them on exit
+    for line in container.logs(stream=True, follow=False):
+        print(line.decode("utf-8", "replace"), end="")
     container.kill()
 
 
 def _random_container_name(prefix="test"):
     max_length = 63
-    suffix = _random_string(max_length)
-    name = prefix + suffix
-    name = re.sub("[^a-z0-9-]", "-", name)
-    name = re.sub("-+", "-", name)
-    name = name[:max_length]
-    name = name.lower()
-    return name
+    # hex digits are always valid in a container name so only clean the prefix,
+    # and only if it isn't valid already as is the case for the default one
+    if not _ALNUM.issuperset(prefix):
+        prefix = _NON_ALNUM.sub("-", prefix)
+    suffix = binascii.hexlify(os.urandom(16)).decode("ascii")
+    return (prefix + suffix)[:max_length]
+
+
+def _random_string(length):
+    # every base32 character carries 5 random bits
+    encoded = base64.b32encode(os.urandom((length * 5 + 7) // 8))
+    return encoded.decode("ascii").lower()[:length]
+
 
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
 
-def _random_string(length, alphabet=string.ascii_lowercase + string.digits):
-    return "".join(random.choice(alphabet) for _ in range(length))
+
+def _iter_chunks(data, chunk_size=64 * 1024):
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset : offset + chunk_size]
 
 
 def _read_stream(stream):
-    buffer = io.BytesIO()
-    buffer.writelines(stream)
-    buffer.seek(0)
-    return buffer.read()
+    return b"".join(stream)
+
+
+def _export_config(testcase):
+    config = {
+        arg_name: arg_value
+        for arg_name, arg_value in vars(testcase.Config).items()
+        if not arg_name.startswith("_")
+    }
+    os.environ[CONFIG_ENV] = json.dumps(
+        {"testcase": testcase.__name__, "config": config}
+    )
+
+
+def _import_config(namespace):
+    exported = os.getenv(CONFIG_ENV)
+    if not exported:
+        return
+
+    exported = json.loads(exported)
+    testcase = namespace[exported["testcase"]]
+    for arg_name, arg_value in exported["config"].items():
+        setattr(testcase.Config, arg_name, arg_value)
+
+
+def _run(testcase, path):
+    import pytest
+
+    has_backend = not getattr(testcase, "__unittest_skip__", False)
+    try:
+        # the backend may fail to come up after it was started so stop it in
+        # any case, stop_backend copes with a partially started one
+        if has_backend:
+            testcase.start_backend()
+
+        # pytest-xdist workers import this module afresh so hand the config over
+        # via the environment, and don't start more workers than there are tests
+        _export_config(testcase)
+        args = ["{}::{}".format(path, testcase.__name__)]
+        if testcase.parallel:
+            num_tests = len(unittest.defaultTestLoader.getTestCaseNames(testcase))
+            workers = min(num_tests, os.cpu_count() or 1)
+            args += ["-n", str(workers), "--dist=load"]
+        else:
+            # xdist expects worker nodes whenever --dist is given, even with -n 0
+            args += ["-p", "no:xdist"]
+        return pytest.main(args)
+    finally:
+        if has_backend:
+            testcase.stop_backend()
 
 
 def _cli(module_name, strip_suffix=""):
@@ -456,6 +791,7 @@ def _cli(module_name, strip_suffix=""):
     testcases = {
         class_name.replace(strip_suffix, "").lower(): test_class
         for class_name, test_class in inspect.getmembers(module, inspect.isclass)
+        if issubclass(test_class, unittest.TestCase)
     }
 
     testcase_arg = "mode"
@@ -482,8 +818,10 @@ def _cli(module_name, strip_suffix=""):
         if not arg_name.startswith("_") and arg_name != testcase_arg:
             setattr(testcase.Config, arg_name, arg_value)
 
-    unittest.main(argv=[sys.argv[0], testcase.__name__])
+    sys.exit(_run(testcase, module.__file__))
+
 
+_import_config(globals())
 
 if __name__ == "__main__":
     _cli(__name__, "StorageTest")